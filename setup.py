@@ -15,6 +15,7 @@ setup(
         'pandas==1.3.4',
         'argparse==1.4.0',
         'netsuitesdk==2.7.0',
+        'rapidfuzz==2.13.7',
         'singer-python==5.12.2'
     ],
     entry_points='''
@@ -1,42 +1,116 @@
 #!/usr/bin/env python3
 import argparse
+import hashlib
 import json
 import logging
 import os
+import pickle
 import sys
+import threading
+import time
+from collections import deque
 
+import backoff
 import pandas as pd
-from difflib import SequenceMatcher
-from heapq import nlargest as _nlargest
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from rapidfuzz import fuzz, process
 
 from target_netsuite.netsuite import NetSuite
 
 from netsuitesdk.internal.exceptions import NetSuiteRequestError
+from zeep.exceptions import Fault
 
 logger = logging.getLogger("target-netsuite")
 logging.basicConfig(
-    level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 )
 
 
-def get_close_matches(word, possibilities, n=20, cutoff=0.7):
-    if not n >  0:
-        raise ValueError("n must be > 0: %r" % (n,))
-    if not 0.0 <= cutoff <= 1.0:
-        raise ValueError("cutoff must be in [0.0, 1.0]: %r" % (cutoff,))
-    result = []
-    s = SequenceMatcher()
-    s.set_seq2(word.lower())
-    for x in possibilities:
-        s.set_seq1(x.lower())
-        if s.real_quick_ratio() >= cutoff and \
-           s.quick_ratio() >= cutoff and \
-           s.ratio() >= cutoff:
-            result.append((s.ratio(), x))
-    result = _nlargest(n, result)
-
-    return {v: k for (k, v) in result}
-
+NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'NULL', 'NaN', 'n/a', 'nan', 'null',"\\N"]
+
+
+def get_match_cache(ref_index, names_key, cutoff):
+    # Fuzzy matching is the costliest step per line and the same values repeat
+    # across lines, so the best match for each word is cached for the run
+    cache = ref_index["matches"].get((names_key, cutoff))
+    if cache is None:
+        # Exact names resolve to themselves without any fuzzy matching
+        cache = {name: name for name in ref_index[names_key]}
+        ref_index["matches"][(names_key, cutoff)] = cache
+    return cache
+
+
+def match_canonical(ref_index, names_key, word):
+    # Names differing only in case or surrounding spaces match exactly
+    canonical = ref_index["canonical"].get(names_key)
+    if canonical is None:
+        canonical = {}
+        for name in ref_index[names_key]:
+            canonical.setdefault(name.strip().casefold(), name)
+        ref_index["canonical"][names_key] = canonical
+    return canonical.get(str(word).strip().casefold())
+
+
+def lowered_names(ref_index, names_key):
+    # Candidates are lowercased once per run instead of on every comparison
+    lowered = ref_index["lowered"].get(names_key)
+    if lowered is None:
+        lowered = [name.lower() for name in ref_index[names_key]]
+        ref_index["lowered"][names_key] = lowered
+    return lowered
+
+
+def match_name(ref_index, names_key, word, cutoff=0.7):
+    cache = get_match_cache(ref_index, names_key, cutoff)
+    if word not in cache:
+        name = match_canonical(ref_index, names_key, word)
+        if name is None:
+            # extractOne raises its cutoff to the best score found so far, so most
+            # candidates are rejected without computing the full ratio
+            match = process.extractOne(
+                word.lower(),
+                lowered_names(ref_index, names_key),
+                scorer=fuzz.ratio,
+                processor=None,
+                score_cutoff=cutoff * 100,
+            )
+            name = ref_index[names_key][match[2]] if match else None
+        cache[word] = name
+    return cache[word]
+
+
+def match_names(ref_index, names_key, words, cutoff=0.7):
+    # Scores all the distinct words of a column against the names in one
+    # multi-threaded cdist call, filling the cache match_name reads from
+    cache = get_match_cache(ref_index, names_key, cutoff)
+    names = ref_index[names_key]
+    pending = []
+    for word in words:
+        if word in cache or not isinstance(word, str):
+            continue
+        name = match_canonical(ref_index, names_key, word)
+        if name is not None:
+            cache[word] = name
+        else:
+            pending.append(word)
+    if not pending or not names:
+        return
+    # Keep each score matrix around 10M cells
+    block_size = max(1, 10_000_000 // len(names))
+    for start in range(0, len(pending), block_size):
+        block = pending[start:start + block_size]
+        scores = process.cdist(
+            [word.lower() for word in block],
+            lowered_names(ref_index, names_key),
+            scorer=fuzz.ratio,
+            processor=None,
+            score_cutoff=cutoff * 100,
+            workers=-1,
+        )
+        for word, word_scores in zip(block, scores):
+            # argmax picks the first best name, like extractOne
+            best = word_scores.argmax()
+            cache[word] = names[best] if word_scores[best] > 0 else None
 
 
 def load_json(path):
@@ -56,6 +130,11 @@ def parse_args():
     parser = argparse.ArgumentParser()
 
     parser.add_argument("-c", "--config", help="Config file", required=True)
+    parser.add_argument(
+        "--refresh-cache",
+        help="Fetch reference data from NetSuite even if it is cached",
+        action="store_true",
+    )
 
     args = parser.parse_args()
     if args.config:
@@ -83,108 +162,255 @@ def get_ns_client(config):
         is_sandbox=is_sandbox,
     )
 
-    ns.connect_tba(caching=False)
+    # The parsed WSDL is cached on disk so each run skips downloading and parsing it,
+    # and the connection pool keeps one connection per concurrent request
+    pool_maxsize = max(
+        config.get("post_concurrency", 4),
+        config.get("reference_data_concurrency", 4) * config.get("page_concurrency", 1),
+    )
+    caching = config.get("wsdl_cache", True)
+    caching_path = get_cache_dir(config)
+    if caching:
+        # netsuitesdk defaults to its install directory, which may be read-only
+        os.makedirs(caching_path, exist_ok=True)
+    ns.connect_tba(caching=caching, caching_path=caching_path, pool_maxsize=pool_maxsize)
     logger.info(f"Successfully created netsuite connection..")
     return ns
 
-def get_reference_data(ns_client, input_data):
-    logger.info(f"Reading reference data from API...")
-    reference_data = {}
-
-    try:
-        if "Location" in input_data.columns:
-            if not input_data["Location"].dropna().empty:
-                reference_data["Locations"] = ns_client.entities["Locations"](ns_client.client).get_all(["name"])
-    except NetSuiteRequestError as e:
-        message = e.message.replace("error", "failure").replace("Error", "")
-        logger.warning(f"It was not possible to retrieve Locations data: {message}")
-    
-    try:
-        if not input_data["Customer Name"].dropna().empty:
-            reference_data["Customer"] = ns_client.entities["Customer"](ns_client.client).get_all([
-                "altName",
-                "name",
-                "entityId",
-                "companyName",
-                "subsidiary",
-                "isInactive"
-            ])
-    except NetSuiteRequestError as e:
-        message = e.message.replace("error", "failure").replace("Error", "")
-        logger.warning(f"It was not possible to retrieve Customer data: {message}")
-    
-    if not input_data["Class"].dropna().empty:
-        reference_data["Classifications"] = ns_client.entities["Classifications"](ns_client.client).get_all(["name", "parent"])
-    
-    if not input_data["Currency"].dropna().empty:
-        reference_data["Currencies"] = ns_client.entities["Currencies"](ns_client.client).get_all()
-
-    if "Subsidiary" in input_data.columns:
-        if not input_data["Subsidiary"].dropna().empty:
-            reference_data["Subsidiaries"] = ns_client.entities["Subsidiaries"](ns_client.client).get_all(["name", "parent"])
-    
-    if "Department" in input_data.columns:
-        if not input_data["Department"].dropna().empty:
-            reference_data["Departments"] = ns_client.entities["Departments"](ns_client.client).get_all(["name", "parent"])
-
-    if "SKU" in input_data.columns:
-        if not input_data["SKU"].dropna().empty:
-            reference_data["Items"] = ns_client.entities["Items"](ns_client.client).get_all(["itemId"])
-        
-    if not input_data["Account Number"].dropna().empty or not input_data["Account Name"].dropna().empty:
-        reference_data["Accounts"] = ns_client.entities["Accounts"](ns_client.client).get_all(["acctName", "acctNumber", "subsidiaryList", "parent"])
+def get_cache_dir(config):
+    return config.get("reference_cache_dir") or os.path.join(os.path.expanduser("~"), ".cache", "target-netsuite")
+
+def get_reference_cache_path(config, entity, fields):
+    cache_dir = get_cache_dir(config)
+    key = json.dumps([config.get("ns_account"), config.get("is_sandbox"), entity, sorted(fields) if fields else None])
+    return os.path.join(cache_dir, f"{entity}-{hashlib.sha1(key.encode()).hexdigest()}.pkl")
+
+def get_all_reference_data(ns_client, config, entity, fields=None):
+    # Reference data changes rarely, it can be cached on disk for reference_cache_ttl seconds
+    ttl = config.get("reference_cache_ttl", 0)
+    cache_path = get_reference_cache_path(config, entity, fields)
+    # refresh_reference_cache is set by --refresh-cache, reference_cache_invalidate
+    # lists the entities to refresh while keeping the others cached
+    refresh = config.get("refresh_reference_cache") or entity in (config.get("reference_cache_invalidate") or [])
+    if ttl and not refresh and os.path.exists(cache_path):
+        if time.time() - os.path.getmtime(cache_path) < ttl:
+            logger.info(f"Using cached {entity} data from {cache_path}")
+            with open(cache_path, "rb") as f:
+                return pickle.load(f)
+
+    if fields is None:
+        records = ns_client.entities[entity](ns_client.client).get_all()
+    else:
+        records = ns_client.entities[entity](ns_client.client).get_all(fields, config.get("page_concurrency", 1))
 
-    return reference_data
+    if ttl:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(records, f)
+        os.replace(tmp_path, cache_path)
 
-def log_for_journal_entry(journal_entry, ref_data):
-    logger.info(f"Posting journal entry: {journal_entry}")
-    try:
-        logging.info(f"Subsidiary: {[s for s in ref_data['Subsidiaries'] if s['internalId'] == journal_entry['subsidiary']['internalId']]}")
-    except:
-        pass
+    return records
 
-    try:
-        logging.info(f"Currency: {[s for s in ref_data['Currencies'] if s['internalId'] == journal_entry['currency']['internalId']]}")
-    except:
-        pass
+def get_reference_data(ns_client, input_data, config):
+    logger.info(f"Reading reference data from API...")
+    reference_data = {}
 
-    try:
-        logger.info(f"Customer: {[s for s in ref_data['Customer'] if s['internalId'] == journal_entry['entity']['internalId']]}")
-    except:
-        pass
+    def has_values(column):
+        return column in input_data.columns and not input_data[column].dropna().empty
+
+    # The searches are independent so they run concurrently
+    # Locations and Customer are optional, the upload continues without them
+    requests = []
+    if has_values("Location"):
+        requests.append(("Locations", ["name"]))
+    if has_values("Customer Name"):
+        requests.append(("Customer", [
+            "altName",
+            "name",
+            "entityId",
+            "companyName",
+            "subsidiary",
+            "isInactive"
+        ]))
+    if has_values("Class"):
+        requests.append(("Classifications", ["name", "parent"]))
+    if has_values("Currency"):
+        requests.append(("Currencies", None))
+    if has_values("Subsidiary"):
+        requests.append(("Subsidiaries", ["name", "parent"]))
+    if has_values("Department"):
+        requests.append(("Departments", ["name", "parent"]))
+    if has_values("SKU"):
+        requests.append(("Items", ["itemId"]))
+
+    if requests:
+        max_workers = min(len(requests), config.get("reference_data_concurrency", 4))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(get_all_reference_data, ns_client, config, entity, fields): entity
+                for entity, fields in requests
+            }
+            for future in as_completed(futures):
+                entity = futures[future]
+                try:
+                    reference_data[entity] = future.result()
+                except NetSuiteRequestError as e:
+                    if entity not in ["Locations", "Customer"]:
+                        raise
+                    message = e.message.replace("error", "failure").replace("Error", "")
+                    logger.warning(f"It was not possible to retrieve {entity} data: {message}")
+
+    # Accounts switch the client's search preferences to bodyFieldsOnly=False,
+    # so they are fetched once the other searches are done
+    if has_values("Account Number") or has_values("Account Name"):
+        reference_data["Accounts"] = get_all_reference_data(ns_client, config, "Accounts", ["acctName", "acctNumber", "subsidiaryList", "parent"])
 
-    try:
-        accounts = [a['account']['internalId'] for a in journal_entry['lineList']]
-        logger.info(f"Accounts: {[a for a in ref_data['Accounts'] if a['internalId'] in accounts]}")
-    except:
-        pass
+    return reference_data
 
-def build_lines(x, ref_data, config):
+def index_hierarchy(records, name_key="name"):
+    # Candidate names follow NetSuite's "Parent : Child" display for records with a parent
+    names = []
+    noparent_names = []
+    by_name = {}
+    for record in records:
+        keys = [record[name_key]]
+        if record.get("parent") is not None:
+            full_name = record["parent"]["name"] + " : " + record[name_key]
+            names.append(full_name)
+            keys.insert(0, full_name)
+        else:
+            noparent_names.append(record[name_key])
+        for key in keys:
+            by_name.setdefault(key, []).append(record)
+    return names + noparent_names, by_name
+
+def index_reference_data(ref_data):
+    logger.info(f"Indexing reference data...")
+    ref_index = {"matches": {}, "canonical": {}, "lowered": {}}
+
+    accounts = ref_data.get("Accounts") or []
+    ref_index["accounts_by_number"] = {}
+    ref_index["accounts_by_name"] = {}
+    for a in accounts:
+        ref_index["accounts_by_number"].setdefault(a["acctNumber"], []).append(a)
+        ref_index["accounts_by_name"].setdefault(a["acctName"], []).append(a)
+    ref_index["account_names"], ref_index["accounts_by_full_name"] = index_hierarchy(accounts, "acctName")
+    ref_index["accounts_by_id"] = {a["internalId"]: a for a in accounts}
+    # First subsidiary of each account, used when a line has no Subsidiary
+    ref_index["account_subsidiaries"] = {}
+    for a in accounts:
+        subsidiary_list = a.get("subsidiaryList")
+        if subsidiary_list and not isinstance(subsidiary_list, list):
+            subsidiary_list = subsidiary_list["recordRef"]
+        ref_index["account_subsidiaries"][a["internalId"]] = subsidiary_list[0] if subsidiary_list else None
+
+    subsidiaries = ref_data.get("Subsidiaries") or []
+    subsidiary_names, ref_index["subsidiaries_by_name"] = index_hierarchy(subsidiaries)
+    ref_index["subsidiaries_by_id"] = {s["internalId"]: s for s in subsidiaries}
+    # Subsidiary names alone are also candidates, for inputs without the parent prefix
+    ref_index["subsidiary_names"] = subsidiary_names + [s["name"] for s in subsidiaries]
+
+    classifications = ref_data.get("Classifications") or []
+    ref_index["class_names"], ref_index["classes_by_name"] = index_hierarchy(classifications)
+
+    departments = ref_data.get("Departments") or []
+    ref_index["department_names"], ref_index["departments_by_name"] = index_hierarchy(departments)
+
+    # Distinct names of active customers, used to match the Customer Name column
+    customer_names = dict.fromkeys(
+        c[key]
+        for c in ref_data.get("Customer") or []
+        if not c.get("isInactive")
+        for key in ["name", "entityId", "altName", "companyName"]
+        if c.get(key)
+    )
+    ref_index["customer_names"] = list(customer_names)
+    ref_index["customer_name_set"] = set(customer_names)
+
+    ref_index["customers_by_internal_id"] = {c["internalId"]: c for c in ref_data.get("Customer") or []}
+
+    # Active customers by internalId and entityId
+    ref_index["customers_by_id"] = {}
+    for c in ref_data.get("Customer") or []:
+        if c.get("isInactive") != False:
+            continue
+        for key in {c.get("internalId"), c.get("entityId")}:
+            if key is not None:
+                ref_index["customers_by_id"].setdefault(key, []).append(c)
+
+    # First customer having the name in any of its name fields
+    ref_index["customers_by_name"] = {}
+    for c in ref_data.get("Customer") or []:
+        for key in ["name", "entityId", "altName", "companyName"]:
+            if c.get(key) is not None:
+                ref_index["customers_by_name"].setdefault(c[key], c)
+
+    ref_index["locations_by_name"] = {}
+    for l in ref_data.get("Locations") or []:
+        ref_index["locations_by_name"].setdefault(l["name"], l)
+
+    # Items are matched to the SKU column by externalId or itemId
+    ref_index["items_by_sku"] = {}
+    for i in ref_data.get("Items") or []:
+        for key in [i.get("externalId"), i.get("itemId")]:
+            if key is not None:
+                ref_index["items_by_sku"].setdefault(key, i["internalId"])
+
+    ref_index["currencies_by_symbol"] = {}
+    ref_index["currencies_by_id"] = {}
+    for c in ref_data.get("Currencies") or []:
+        ref_index["currencies_by_symbol"].setdefault(c["symbol"], c)
+        ref_index["currencies_by_id"][c["internalId"]] = c
+
+    return ref_index
+
+def log_for_journal_entry(journal_entry, ref_index):
+    # The reference records of each journal are only looked up for debug output
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    logger.debug("Posting journal entry: %s", journal_entry)
+    if journal_entry.get("subsidiary"):
+        logger.debug("Subsidiary: %s", ref_index["subsidiaries_by_id"].get(journal_entry["subsidiary"]["internalId"]))
+
+    if journal_entry.get("currency"):
+        logger.debug("Currency: %s", ref_index["currencies_by_id"].get(journal_entry["currency"]["internalId"]))
+
+    if journal_entry.get("entity"):
+        logger.debug("Customer: %s", ref_index["customers_by_internal_id"].get(journal_entry["entity"]["internalId"]))
+
+    accounts = dict.fromkeys(line["account"]["internalId"] for line in journal_entry["lineList"])
+    logger.debug("Accounts: %s", [ref_index["accounts_by_id"][a] for a in accounts if a in ref_index["accounts_by_id"]])
+
+def build_lines(x, ref_data, ref_index, config):
 
     line_items = []
     subsidiaries = {}
+    columns = list(x.columns)
+    has_description = "Description" in columns
+    # Amount and Posting Type are normalized for all lines in load_journal_entries
+    amounts = x["Amount"].to_numpy()
+    is_credit = (x["Posting Type"] == "credit").to_numpy()
+    is_debit = (x["Posting Type"] == "debit").to_numpy()
+    account_numbers = x["Account Number"].astype(str).to_numpy()
+    account_names = x["Account Name"].astype(str).to_numpy()
+    # Missing values per column, absent optional columns count as missing
+    missing = {col: x[col].isna().to_numpy() for col in columns}
+    all_missing = [True] * len(x)
     # Create line items
-    for _, row in x.iterrows():
+    for i, values in enumerate(x.itertuples(index=False, name=None)):
+        row = dict(zip(columns, values))
         #  Using Account Number if provided 
-        if ref_data.get("Accounts") and row.get("Account Number") and not pd.isna(row.get("Account Number")):
-            acct_num = str(row["Account Number"])
-            acct_data = [a for a in ref_data["Accounts"] if a["acctNumber"] == acct_num]
+        if ref_data.get("Accounts") and row.get("Account Number") and not missing["Account Number"][i]:
+            acct_num = account_numbers[i]
+            acct_data = ref_index["accounts_by_number"].get(acct_num, [])
             if not acct_data:
                 raise ValueError(f"Account Number {row.get('Account Number')} is not found in this Netsuite account")
                  
             if len(acct_data) > 1 and row.get("Account Name"):
-                logging.info(f"Multiple accounts with account number {row.get('Account Number')}, using account name to resolve")
-                acct_name = str(row["Account Name"])
-                acct_parent_names = [
-                    s["parent"]["name"] + " : " + s["acctName"]
-                    for s in ref_data["Accounts"]
-                    if s.get("parent") is not None
-                ]
-                acct_noparent_names = [s["acctName"] for s in ref_data["Accounts"] if s.get("parent") is None]
-                acct_names = acct_parent_names + acct_noparent_names
-                acct_name = get_close_matches(acct_name, acct_names)
-                acct_name = max(acct_name, key=acct_name.get)
-                acct_data = [a for a in ref_data["Accounts"] if (a.get("parent") and (a["parent"]["name"] + " : " + a["acctName"]) == acct_name) or (a["acctName"]==acct_name)]
+                logger.info("Multiple accounts with account number %s, using account name to resolve", row.get("Account Number"))
+                acct_name = match_name(ref_index, "account_names", account_names[i])
+                acct_data = ref_index["accounts_by_full_name"].get(acct_name, [])
                 if len(acct_data) == 0:
                     possible_accts = [a["acctName"] for a in ref_data["Accounts"]]
                     raise ValueError(
@@ -192,11 +418,11 @@ def build_lines(x, ref_data, config):
                     )
 
         # Using Account Name if provided
-        elif ref_data.get("Accounts") and row.get("Account Name") and not pd.isna(row.get("Account Name")):
-            acct_name = str(row["Account Name"])
-            acct_data = [a for a in ref_data["Accounts"] if a["acctName"] == acct_name]
+        elif ref_data.get("Accounts") and row.get("Account Name") and not missing["Account Name"][i]:
+            acct_name = account_names[i]
+            acct_data = ref_index["accounts_by_name"].get(acct_name, [])
             if not acct_data:
-                logger.warning(f"{acct_name} is not valid for this netsuite account, skipping line")
+                logger.warning("%s is not valid for this netsuite account, skipping line", acct_name)
                 continue
         else: 
             raise TypeError(f"Account Number or Account Name is required")
@@ -210,23 +436,10 @@ def build_lines(x, ref_data, config):
         journal_entry_line = {"account": ref_acct}
 
         # Get subsidiary
-        if not pd.isna(row.get("Subsidiary")):
-            subsidiary_parent_names = [
-                s["parent"]["name"] + " : " + s["name"]
-                for s in ref_data["Subsidiaries"]
-                if s.get("parent") is not None
-            ]
-            subsidiary_noparent_names = [s["name"] for s in ref_data["Subsidiaries"] if s.get("parent") is None]
-            subsidiary_names = subsidiary_parent_names + subsidiary_noparent_names
-            subsidiary_name = get_close_matches(row["Subsidiary"], subsidiary_names)
-
-            ## secondary check for Subsidiary names alone if no match
-            subsidiary_names = [s["name"] for s in ref_data['Subsidiaries']]
-            subsidiary_name.update(get_close_matches(row['Subsidiary'],subsidiary_names))
-
+        if not missing.get("Subsidiary", all_missing)[i]:
+            subsidiary_name = match_name(ref_index, "subsidiary_names", row["Subsidiary"])
             if subsidiary_name:
-                subsidiary_name = max(subsidiary_name, key=subsidiary_name.get)
-                subsidiary_data = [s for s in ref_data["Subsidiaries"] if (s.get("parent") and (s["parent"]["name"] + " : " + s["name"]) == subsidiary_name) or (s["name"]==subsidiary_name)]
+                subsidiary_data = ref_index["subsidiaries_by_name"].get(subsidiary_name)
                 if subsidiary_data:
                     subsidiary_data = subsidiary_data[0]
                     subsidiary = {
@@ -240,35 +453,20 @@ def build_lines(x, ref_data, config):
                 subsidiary = None
         # Extract the subsidiaries from Account
         else:
-            if acct_data['subsidiaryList']:
-                if isinstance(acct_data['subsidiaryList'], list):
-                    subsidiary = acct_data['subsidiaryList'][0]
-                else:
-                    subsidiary = acct_data['subsidiaryList']['recordRef']
-                    subsidiary = subsidiary[0] if subsidiary else None
-            else:
-                subsidiary = None
+            subsidiary = ref_index["account_subsidiaries"].get(acct_data["internalId"])
         if subsidiary:
-            if row["Posting Type"].lower() == "credit":
+            if is_credit[i]:
                 subsidiaries["toSubsidiary"] = subsidiary
-            elif row["Posting Type"].lower() == "debit":
+            elif is_debit[i]:
                 subsidiaries["subsidiary"] = subsidiary
             else:
                 raise('Posting Type must be "credit" or "debit"')
 
         # Get the NetSuite Class Ref
-        if ref_data.get("Classifications") and row.get("Class") and not pd.isna(row.get("Class")):
-            class_parent_names = [
-                c["parent"]["name"] + " : " + c["name"]
-                for c in ref_data["Classifications"]
-                if c.get("parent") is not None
-            ]
-            class_noparent_names = [c["name"] for c in ref_data["Classifications"] if c.get("parent") is None]
-            class_names = class_parent_names + class_noparent_names
-            class_name = get_close_matches(row["Class"], class_names)
+        if ref_data.get("Classifications") and row.get("Class") and not missing["Class"][i]:
+            class_name = match_name(ref_index, "class_names", row["Class"])
             if class_name:
-                class_name = max(class_name, key=class_name.get)
-                class_data = [c for c in ref_data["Classifications"] if (c.get("parent") and (c["parent"]["name"] + " : " + c["name"]) == class_name) or (c["name"]==class_name)]
+                class_data = ref_index["classes_by_name"].get(class_name)
                 if class_data:
                     class_data = class_data[0]
                     journal_entry_line["class"] = {
@@ -278,18 +476,10 @@ def build_lines(x, ref_data, config):
                     }
 
         # Get the NetSuite Department Ref
-        if ref_data.get("Departments") and row.get("Department") and not pd.isna(row.get("Department")):
-            department_parent_names = [
-                c["parent"]["name"] + " : " + c["name"]
-                for c in ref_data["Departments"]
-                if c.get("parent") is not None
-            ]
-            department_noparent_names = [d["name"] for d in ref_data["Departments"] if d.get("parent") is None]
-            dept_names = department_parent_names + department_noparent_names
-            dept_name = get_close_matches(row["Department"], dept_names)
+        if ref_data.get("Departments") and row.get("Department") and not missing.get("Department", all_missing)[i]:
+            dept_name = match_name(ref_index, "department_names", row["Department"])
             if dept_name:
-                dept_name = max(dept_name, key=dept_name.get)
-                dept_data = [d for d in ref_data["Departments"] if (d.get("parent") and (d["parent"]["name"] + " : " + d["name"]) == dept_name) or (d["name"] == dept_name)]
+                dept_data = ref_index["departments_by_name"].get(dept_name)
                 if dept_data:
                     dept_data = dept_data[0]
                     journal_entry_line["department"] = {
@@ -299,10 +489,9 @@ def build_lines(x, ref_data, config):
                     }
 
         # Get the NetSuite Location Ref
-        if ref_data.get("Locations") and row.get("Location") and not pd.isna(row.get("Location")):
-            loc_data = [l for l in ref_data["Locations"] if l["name"] == row["Location"]]
+        if ref_data.get("Locations") and row.get("Location") and not missing.get("Location", all_missing)[i]:
+            loc_data = ref_index["locations_by_name"].get(row["Location"])
             if loc_data:
-                loc_data = loc_data[0]
                 journal_entry_line["location"] = {
                     "name": loc_data.get("name"),
                     "externalId": loc_data.get("externalId"),
@@ -316,54 +505,20 @@ def build_lines(x, ref_data, config):
         if ref_data.get("Customer") and not (pd.isna(customer_name) and pd.isna(customer_id)):
             if customer_id: 
                 # Search for the customer based on the customer id
-                # and removes inactive customers so the line is skipped
-                customer = list(
-                    filter(
-                        lambda x: (x['internalId'] == str(customer_id) or x['entityId'] == str(customer_id)) and (x["isInactive"] == False),
-                        ref_data['Customer']
-                    )
-                )
+                # inactive customers are not indexed so the line is skipped
+                customer = ref_index["customers_by_id"].get(str(customer_id), [])
 
                 if len(customer) > 1 and customer_name:
                     # If customer id is duplicated, search for the customer based on the customer name
                     customer = list(filter(lambda x: x.get('companyName') == customer_name, customer))
             
             if not customer_id or not customer:
-                customer_names = []
-                for c in ref_data["Customer"]:
-                    if c.get("isInactive"):
-                        continue
-                    if c.get("name"):
-                        customer_names.append(c["name"])
-                    if c.get("entityId"):
-                        customer_names.append(c["entityId"])
-                    if c.get("altName"):
-                        customer_names.append(c["altName"])
-                    if c.get("companyName"):
-                        customer_names.append(c["companyName"])
                 # only get close matches if the exact same name is not present in customers
-                if customer_name in customer_names:
-                    customer_name = {customer_name: 1}
-                else:
-                    customer_name = get_close_matches(row["Customer Name"], customer_names, n=2, cutoff=0.95)
+                if customer_name not in ref_index["customer_name_set"]:
+                    customer_name = match_name(ref_index, "customer_names", row["Customer Name"], cutoff=0.95)
                 if customer_name:
-                    customer_name = max(customer_name, key=customer_name.get)
-                    customer_data = []
-                    for c in ref_data["Customer"]:
-                        if "name" in c.keys():
-                            if c["name"] == customer_name:
-                                customer_data.append(c)
-                        if "entityId" in c.keys():
-                            if c["entityId"] == customer_name:
-                                customer_data.append(c)
-                        if "altName" in c.keys():
-                            if c["altName"] == customer_name:
-                                customer_data.append(c)
-                        if "companyName" in c.keys():
-                            if c["companyName"] == customer_name:
-                                customer_data.append(c)
+                    customer_data = ref_index["customers_by_name"].get(customer_name)
                     if customer_data:
-                        customer_data = customer_data[0]
                         journal_entry_line["entity"] = {
                             "externalId": customer_data.get("externalId"),
                             "internalId": customer_data.get("internalId"),
@@ -376,14 +531,14 @@ def build_lines(x, ref_data, config):
 
         custom_field_values = []
 
-        if row.get("SKU") and not pd.isna(row.get("SKU")) and config.get("sku_custom_field"):
+        if row.get("SKU") and not missing.get("SKU", all_missing)[i] and config.get("sku_custom_field"):
             external_id = config.get("sku_custom_field")
             if config.get("sku_item_lookup", False):
-              item_id = next((i["internalId"] for i in ref_data["Items"] if (i["externalId"]==row["SKU"] or i['itemId'] == row["SKU"])), None)
+              item_id = ref_index["items_by_sku"].get(row["SKU"])
               if item_id:
-                   custom_field_values.append([{"type": "Select", "scriptId": external_id, "value": item_id}])
+                   custom_field_values.append({"type": "Select", "scriptId": external_id, "value": item_id})
             else:
-              custom_field_values.append([{"type": "Select", "scriptId": external_id, "value": row['SKU']}])
+              custom_field_values.append({"type": "Select", "scriptId": external_id, "value": row['SKU']})
 
         # Support dynamic custom fields
         custom_fields = config.get("custom_fields") or []
@@ -392,97 +547,136 @@ def build_lines(x, ref_data, config):
             value = row.get(entry.get("input_id"))
             ns_id = entry.get("netsuite_id")
             if value:
-                custom_field_values.append([{"type": "Select", "scriptId": ns_id, "value": value}])
+                custom_field_values.append({"type": "Select", "scriptId": ns_id, "value": value})
 
         if custom_field_values:
             journal_entry_line["customFieldList"] = custom_field_values
 
         # Check the Posting Type and insert the Amount
-        amount = 0 if pd.isna(row["Amount"]) else abs(round(row["Amount"], 2))
-        if row["Posting Type"].lower() == "credit":
+        amount = amounts[i]
+        if is_credit[i]:
             journal_entry_line["credit"] = amount
-        elif row["Posting Type"].lower() == "debit":
+        elif is_debit[i]:
             journal_entry_line["debit"] = amount
 
         # Insert the Journal Entry to the memo field
-        if "Description" in x.columns:
+        if has_description:
             journal_entry_line["memo"] = row["Description"]
         
         line_items.append(journal_entry_line)
 
-    # Get the currency ID
-    if ref_data.get("Currencies") and row.get("Currency"):
-        currency_data = [
-            c for c in ref_data["Currencies"] if c["symbol"] == row["Currency"]
-            ]
-        if currency_data:
-            currency_data = currency_data[0]
-            currency_ref = {
-                "name": currency_data.get("symbol"),
-                "externalId": currency_data.get("externalId"),
-                "internalId": currency_data.get("internalId"),
-            }
-    else:
-        currency_ref = None
-
     # Check if subsidiary is duplicated and delete toSubsidiary if true
     if len(subsidiaries)>1:
         if subsidiaries['subsidiary'] == subsidiaries['toSubsidiary']:
             del subsidiaries['toSubsidiary']
 
+    # Journal level fields come from the first line
+    first = x.iloc[0]
     if "Transaction Date" in x.columns:
-        created_date = pd.to_datetime(x["Transaction Date"].iloc[0])
+        created_date = first["Transaction Date"]
     else:
         created_date = None
 
+    # Get the currency ID
+    currency_ref = None
+    if ref_data.get("Currencies") and "Currency" in x.columns:
+        # The currency may only be filled in on some of the lines
+        currencies = x["Currency"].dropna()
+        currency_data = ref_index["currencies_by_symbol"].get(currencies.iloc[0]) if len(currencies) else None
+        if currency_data:
+            currency_ref = {
+                "name": currency_data.get("symbol"),
+                "externalId": currency_data.get("externalId"),
+                "internalId": currency_data.get("internalId"),
+            }
+
     # Create the journal entry
     journal_entry = {
         "createdDate": created_date,
         "tranDate": created_date,
-        "externalId": x["Journal Entry Id"].iloc[0],
+        "externalId": first["Journal Entry Id"],
         "lineList": line_items,
         "currency": currency_ref
     }
 
     if "JournalDesc" in x.columns:
-        journal_entry["memo"] = "" if pd.isnull(x["JournalDesc"].iloc[0]) else x["JournalDesc"].iloc[0]
+        journal_entry["memo"] = "" if pd.isnull(first["JournalDesc"]) else first["JournalDesc"]
     
     # Update the entry with subsidiaries
     journal_entry.update(subsidiaries)
-    log_for_journal_entry(journal_entry, ref_data)
+    log_for_journal_entry(journal_entry, ref_index)
     return journal_entry
 
 
 def load_journal_entries(input_data, reference_data, config):
-    # Build the entries
+    reference_index = index_reference_data(reference_data)
+
+    # Normalize the posting fields of all lines at once
+    input_data = input_data.assign(**{
+        "Posting Type": input_data["Posting Type"].str.lower(),
+        "Amount": input_data["Amount"].abs().round(2).fillna(0),
+    })
+    # A line without a credit/debit Posting Type would leave its journal unbalanced
+    invalid_posting = ~input_data["Posting Type"].isin(["credit", "debit"])
+    if invalid_posting.any():
+        logger.error(
+            f"Lines with a missing or invalid Posting Type. Journal Entry Ids: {input_data.loc[invalid_posting, 'Journal Entry Id'].unique().tolist()}"
+        )
+        raise ValueError('Posting Type must be "credit" or "debit"')
+
+    # Match the distinct names of each column up front instead of line by line
+    fuzzy_columns = [
+        ("Subsidiaries", "Subsidiary", "subsidiary_names", 0.7),
+        ("Classifications", "Class", "class_names", 0.7),
+        ("Departments", "Department", "department_names", 0.7),
+    ]
+    for entity, column, names_key, cutoff in fuzzy_columns:
+        if reference_data.get(entity) and column in input_data.columns:
+            match_names(reference_index, names_key, input_data[column].dropna().unique(), cutoff)
+    # Customer names are only matched on lines without a customer id
+    if reference_data.get("Customer") and "Customer Name" in input_data.columns:
+        no_id = pd.Series(True, index=input_data.index)
+        for column in ["Customer Id", "Customer ID"]:
+            if column in input_data.columns:
+                no_id &= input_data[column].isna()
+        customer_names = input_data.loc[no_id, "Customer Name"].dropna().unique()
+        match_names(reference_index, "customer_names", customer_names, 0.95)
+
+    if "Journal Entry Id" in input_data.columns and "Subsidiary" in input_data.columns:
+        group_by = ["Journal Entry Id", "Subsidiary"]
+    else:
+        # Assuming Journal Entry Id will always be present
+        group_by = ["Journal Entry Id"]
+
+    # Build the entries one at a time, in the order the journals appear in the input
+    loaded = 0
     try:
-        if "Journal Entry Id" in input_data.columns and "Subsidiary" in input_data.columns:
-            lines = input_data.groupby(["Journal Entry Id",'Subsidiary']).apply(build_lines, reference_data, config)
-        else:
-            # Assuming Journal Entry Id will always be present
-            lines = input_data.groupby(["Journal Entry Id"]).apply(build_lines, reference_data, config)
+        for _, x in input_data.groupby(group_by, sort=False):
+            yield build_lines(x, reference_data, reference_index, config)
+            loaded += 1
     except RuntimeError as e:
         raise Exception("Building Netsuite JournalEntries failed!")
 
     # Print journal entries
-    logger.info(f"Loaded {len(lines)} journal entries to post")
-
-    return lines.values
+    logger.info(f"Loaded {loaded} journal entries to post")
 
 
-def post_journal_entries(journal, ns_client):
+# Upserts are keyed by externalId, so retrying a rejected request is safe
+@backoff.on_exception(backoff.expo, Fault, max_tries=5, factor=3)
+def post_journal_entries(journals, ns_client):
         entity = "JournalEntry"
-        # logger.info(f"Posting data for entity {1}")
-        response = ns_client.entities[entity](ns_client.client).post(journal)
-        return json.dumps({entity: response}, default=str, indent=2)
+        logger.info("Posting journal entries: %s", [journal["externalId"] for journal in journals])
+        logger.debug("Posting journals: %s", journals)
+        if len(journals) == 1:
+            responses = [ns_client.entities[entity](ns_client.client).post(journals[0])]
+        else:
+            responses = ns_client.entities[entity](ns_client.client).post_many(journals)
+        return responses
 
 
 def read_input_data(config):
     # Get input path
     input_path = f"{config['input_path']}/JournalEntries.csv"
-    # Read the passed CSV
-    input_data = pd.read_csv(input_path, keep_default_na=False, na_values=['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'NULL', 'NaN', 'n/a', 'nan', 'null',"\\N"])
-    cols = list(input_data.columns)
     REQUIRED_COLS = [
         "Transaction Date",
         "Journal Entry Id",
@@ -493,42 +687,108 @@ def read_input_data(config):
         "Posting Type",
         "Description",
     ]
+    OPTIONAL_COLS = [
+        "Amount",
+        "Currency",
+        "Subsidiary",
+        "Location",
+        "Department",
+        "Customer Id",
+        "Customer ID",
+        "SKU",
+        "JournalDesc",
+    ]
+    custom_field_cols = [entry.get("input_id") for entry in config.get("custom_fields") or []]
+    used_cols = set(REQUIRED_COLS + OPTIONAL_COLS + custom_field_cols)
+    # Read the passed CSV, skipping columns the target doesn't use
+    input_data = pd.read_csv(
+        input_path,
+        usecols=lambda col: col in used_cols,
+        engine="c",
+        dtype={
+            "Journal Entry Id": str,
+            "Account Number": str,
+            "Customer Id": str,
+            "Customer ID": str,
+            "SKU": str,
+            "Amount": float,
+            "Posting Type": "category",
+            "Currency": "category",
+        },
+        # "NA" and "N/A" are kept as values, they can be valid names
+        keep_default_na=False,
+        na_values=NA_VALUES,
+    )
+    cols = list(input_data.columns)
     # Verify it has required columns
-    if not all(col in cols for col in REQUIRED_COLS):
+    missing_cols = set(REQUIRED_COLS) - set(cols)
+    if missing_cols:
         logger.error(
-            f"CSV is mising REQUIRED_COLS. Found={json.dumps(cols)}, Required={json.dumps(REQUIRED_COLS)}"
+            f"CSV is mising REQUIRED_COLS. Missing={json.dumps(sorted(missing_cols))}, Found={json.dumps(cols)}, Required={json.dumps(REQUIRED_COLS)}"
         )
         sys.exit(1)
-    
+
+    # Parse the dates once for the whole file, repeated dates are parsed once
+    input_data["Transaction Date"] = pd.to_datetime(input_data["Transaction Date"], cache=True)
+
     return input_data
 
-def upload_journals(config, ns_client):
-    # Read input data
-    input_data = read_input_data(config)
-    
+def upload_journals(config, ns_client, input_data):
     # Load reference data
-    reference_data = get_reference_data(ns_client, input_data)
+    reference_data = get_reference_data(ns_client, input_data, config)
     # Load Journal Entries CSV to post + Convert to NetSuite format
     journals = load_journal_entries(input_data, reference_data, config)
 
-    # Post the journal entries to Netsuite
-    for journal in journals:
-        logger.info(f"Posting journal: {journal}")
-        response = post_journal_entries(journal, ns_client)
-        logger.info(f"Posted journal: {response}")
+    # Post the journal entries to Netsuite, post_concurrency requests at a time
+    # of up to post_batch_size journals each
+    # Journals are built as posting progresses, only a few are held in memory
+    post_concurrency = config.get("post_concurrency", 4)
+    # NetSuite accepts at most 200 records per upsertList request
+    post_batch_size = min(config.get("post_batch_size", 1), 200)
+    posted = 0
+
+    def collect(future):
+        responses = future.result()
+        for response in responses:
+            # Responses are only serialized when debug logging is enabled
+            logger.debug("Posted journal: %s", response)
+        return len(responses)
+
+    with ThreadPoolExecutor(max_workers=post_concurrency) as executor:
+        pending = deque()
+        batch = []
+        for journal in journals:
+            batch.append(journal)
+            if len(batch) < post_batch_size:
+                continue
+            pending.append(executor.submit(post_journal_entries, batch, ns_client))
+            batch = []
+            if len(pending) >= 2 * post_concurrency:
+                posted += collect(pending.popleft())
+        if batch:
+            pending.append(executor.submit(post_journal_entries, batch, ns_client))
+        while pending:
+            posted += collect(pending.popleft())
 
-    logger.info(f"Posted journal entries: ")
-    logger.info(f"{json.dumps(journals,default=str)}")
+    logger.info(f"Posted {posted} journal entries")
 
 def upload(config, args):
-    # Login to NetSuite
-    ns = get_ns_client(config)
-    ns_client = ns.ns_client
-
-    if os.path.exists(f"{config['input_path']}/JournalEntries.csv"):
-        logger.info("Found JournalEntries.csv, uploading...")
-        upload_journals(config, ns_client)
-        logger.info("JournalEntries.csv uploaded!")
+    if args.refresh_cache:
+        config["refresh_reference_cache"] = True
+
+    has_journals = os.path.exists(f"{config['input_path']}/JournalEntries.csv")
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        # Read the input while logging in to NetSuite, both take a while on large runs
+        input_future = executor.submit(read_input_data, config) if has_journals else None
+
+        # Login to NetSuite
+        ns = get_ns_client(config)
+        ns_client = ns.ns_client
+
+        if has_journals:
+            logger.info("Found JournalEntries.csv, uploading...")
+            upload_journals(config, ns_client, input_future.result())
+            logger.info("JournalEntries.csv uploaded!")
 
     logger.info("Posting process has completed!")
 
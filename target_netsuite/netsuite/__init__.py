@@ -117,14 +117,16 @@ class NetSuite:
         else:
             return NS_OBJECT_DEFINITIONS[sobject]
 
-    def connect_tba(self, caching=True):
+    def connect_tba(self, caching=True, caching_path=None, pool_maxsize=10):
         nc = ExtendedNetSuiteConnection(
             account=self.ns_account,
             consumer_key=self.ns_consumer_key,
             consumer_secret=self.ns_consumer_secret,
             token_key=self.ns_token_key,
             token_secret=self.ns_token_secret,
-            caching=caching
+            caching=caching,
+            caching_path=caching_path,
+            pool_maxsize=pool_maxsize
         )
         self.ns_client = nc
 
@@ -1,11 +1,55 @@
 from netsuitesdk.internal.client import NetSuiteClient
+from requests.adapters import HTTPAdapter
+import singer
 
+LOGGER = singer.get_logger()
 
 class ExtendedNetSuiteClient(NetSuiteClient):
-    def __init__(self, account=None, caching=True, caching_timeout=2592000):
-        NetSuiteClient.__init__(self, account, caching, caching_timeout)
+    def __init__(self, account=None, caching=True, caching_timeout=2592000, caching_path=None, pool_maxsize=10):
+        NetSuiteClient.__init__(self, account, caching, caching_timeout, caching_path)
+        # Keep a connection per concurrent request alive instead of reconnecting
+        adapter = HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize)
+        self._client.transport.session.mount('https://', adapter)
         self._search_preferences = self.SearchPreferences(
             bodyFieldsOnly=True,
             pageSize=1000,
             returnSearchColumns=True
         )
+
+    def upsertList(self, records):
+        """
+        Add or update a list of records keyed by their externalId, in one request.
+        netsuitesdk ships this method commented out.
+
+        :param list[CompoundValue] records: the records to be created or updated (200 at most)
+        :return: references to the created or updated records, in the same order
+        :rtype: list[RecordRef]
+        """
+
+        response = self.request('upsertList', record=records)
+        write_response_list = response.body.writeResponseList
+        # a rejected request comes back without a response per record
+        status = write_response_list.status
+        if status is not None and not status.isSuccess:
+            raise self._request_error('upsertList', detail=status['statusDetail'][0])
+        responses = write_response_list.writeResponse or []
+        if len(responses) != len(records):
+            raise self._request_error(
+                'upsertList',
+                detail={'code': 'UNEXPECTED_RESPONSE',
+                        'message': f'{len(responses)} responses for {len(records)} records'}
+            )
+        record_refs = []
+        errors = []
+        # each record has its own status, failures are reported together
+        for record, response in zip(records, responses):
+            status = response.status
+            if status.isSuccess:
+                record_refs.append(response['baseRef'])
+            else:
+                exc = self._request_error('upsertList', detail=status['statusDetail'][0])
+                LOGGER.error(f"Error upserting record {record['externalId']}: {exc}")
+                errors.append(exc)
+        if errors:
+            raise errors[0]
+        return record_refs
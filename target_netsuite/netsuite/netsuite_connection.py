@@ -1,7 +1,6 @@
 from netsuitesdk.api.currencies import Currencies
 
 import time
-import json
 import singer
 from .transaction_entities import Customers, JournalEntries, Locations, Departments, Accounts, Classifications, Subsidiaries, Items
 from .netsuite_client import ExtendedNetSuiteClient
@@ -10,11 +9,11 @@ LOGGER = singer.get_logger()
 
 
 class ExtendedNetSuiteConnection:
-    def __init__(self, account, consumer_key, consumer_secret, token_key, token_secret, caching=True):
+    def __init__(self, account, consumer_key, consumer_secret, token_key, token_secret, caching=True, caching_path=None, pool_maxsize=10):
         # NetSuiteConnection.__init__(self, account, consumer_key, consumer_secret, token_key, token_secret)
         # ns_client: NetSuiteClient = self.client
 
-        self.client = ExtendedNetSuiteClient(account=account, caching=caching)
+        self.client = ExtendedNetSuiteClient(account=account, caching=caching, caching_path=caching_path, pool_maxsize=pool_maxsize)
         self.client.connect_tba(
             consumer_key=consumer_key,
             consumer_secret=consumer_secret,
@@ -56,9 +55,8 @@ class ExtendedNetSuiteConnection:
             data = entity.get_all()
 
         if hasattr(entity, 'require_paging') and entity.require_paging is True:
-            transformed_data = json.dumps({stream: data}, default=str, indent=2)
-            data = json.loads(transformed_data)
-            to_return = list(self._query_entity(data, entity, stream))
+            # only the internalId of each record is read, no need to serialize them
+            to_return = list(self._query_entity({stream: data}, entity, stream))
         else:
             to_return = data
 
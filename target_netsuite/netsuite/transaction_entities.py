@@ -1,40 +1,82 @@
-from collections import OrderedDict
+import copy
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from netsuitesdk.internal.utils import PaginatedSearch
 import backoff
 
 from netsuitesdk.api.base import ApiBase
 
-from zeep.exceptions import Fault
+from requests.exceptions import RequestException
+from zeep.exceptions import Fault, TransportError
 
 import singer
 
 logger = singer.get_logger()
 
+RETRY_ERRORS = (Fault, TransportError, RequestException)
+
 class BaseFilter(ApiBase):
-    def get_all(self, selected_fileds=[]):
+    def get_all(self, selected_fileds=[], page_concurrency=1):
         output = []
         page_n = 1
-        selected_fileds = selected_fileds + ["externalId", "internalId"]
-        for page in self.get_page():
+        # only the selected fields are read from each record, instead of checking every field
+        selected_fileds = list(dict.fromkeys(selected_fileds + ["externalId", "internalId"]))
+        for page in self.get_pages(page_concurrency):
             logger.info(f"Getting {self.type_name}: page {page_n}")
             for record in page:
-                record = record.__dict__["__values__"]
+                record = record.__values__
                 rec_dict = {}
-                for k, v in record.items():
-                    if k in selected_fileds:
-                        if getattr(v, "__dict__", None) and v.__dict__["__values__"].get("recordRef"):
-                            values = v.__dict__["__values__"]["recordRef"]
-                            rec_dict[k] = [dict(value.__dict__["__values__"]) for value in values]
-                        else:
-                            rec_dict[k] = v
+                for k in selected_fileds:
+                    if k not in record:
+                        continue
+                    v = record[k]
+                    nested = getattr(v, "__values__", None)
+                    if nested is not None and nested.get("recordRef"):
+                        rec_dict[k] = [dict(value.__values__) for value in nested["recordRef"]]
+                    elif nested is not None:
+                        # unwrap nested records (e.g. parent) once so lookups are plain dict access
+                        rec_dict[k] = dict(nested)
+                    else:
+                        rec_dict[k] = v
                 output.append(rec_dict)
             page_n +=1
         return output
     
-    @backoff.on_exception(backoff.expo, (Fault, Exception), max_tries=5, factor=3)
-    def get_page(self):
-        for page in self.get_all_generator():
-            yield page
+    def paginated_search(self):
+        return PaginatedSearch(client=self.ns_client, type_name=self.type_name)
+
+    # only faults and transport errors are retried, request errors such as a missing
+    # permission are raised right away
+    @backoff.on_exception(backoff.expo, RETRY_ERRORS, max_tries=5, factor=3)
+    def search(self):
+        return self.paginated_search()
+
+    @backoff.on_exception(backoff.expo, RETRY_ERRORS, max_tries=5, factor=3)
+    def get_page(self, paginated_search, page_index):
+        # each page is fetched on its own copy of the search so pages can be fetched concurrently
+        paginated_search = copy.copy(paginated_search)
+        paginated_search.goto_page(page_index)
+        return paginated_search.records
+
+    def get_pages(self, page_concurrency=1):
+        paginated_search = self.search()
+        if paginated_search.num_records == 0:
+            return
+        # the search itself returns the first page
+        yield paginated_search.records
+        page_indexes = range(2, paginated_search.total_pages + 1)
+        # pages are fetched in the background while the previous ones are processed,
+        # even a single worker keeps the next page request in flight
+        page_concurrency = max(page_concurrency, 1)
+        with ThreadPoolExecutor(max_workers=page_concurrency) as executor:
+            # at most page_concurrency + 1 pages are requested ahead, yielded in order
+            pending = deque()
+            for page_index in page_indexes:
+                pending.append(executor.submit(self.get_page, paginated_search, page_index))
+                if len(pending) > page_concurrency:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
 
 
 class Customers(BaseFilter):
@@ -42,13 +84,15 @@ class Customers(BaseFilter):
         ApiBase.__init__(self, ns_client=ns_client, type_name='customer')
         self.require_lastModified_date = True
 
-    def get_all_generator(self, page_size=1000, last_modified_date=None):
+    def paginated_search(self, page_size=1000, last_modified_date=None):
         search_record = self.ns_client.basic_search_factory(type_name="Customer",
                                                             lastModifiedDate=last_modified_date)
         
-        ps = PaginatedSearch(client=self.ns_client, type_name='Customer', pageSize=page_size,
-                             search_record=search_record)
-        return self._paginated_search_generator(ps)
+        return PaginatedSearch(client=self.ns_client, type_name='Customer', pageSize=page_size,
+                               search_record=search_record)
+
+    def get_all_generator(self, page_size=1000, last_modified_date=None):
+        return self._paginated_search_generator(self.paginated_search(page_size, last_modified_date))
 
     def post(self, data) -> OrderedDict:
         return None
@@ -90,6 +134,9 @@ class Items(BaseFilter):
 
 
 class JournalEntries(ApiBase):
+    # journal level fields copied as is from the journal entry data
+    passthrough_fields = ('customFieldList', 'memo', 'tranDate', 'tranId', 'subsidiary', 'class', 'location', 'department')
+
     def __init__(self, ns_client):
         ApiBase.__init__(self, ns_client=ns_client, type_name='journalEntry')
         self.require_lastModified_date = True
@@ -116,67 +163,65 @@ class JournalEntries(ApiBase):
 
         return self._paginated_search_to_generator(paginated_search=paginated_search)
     
-    def prepare_custom_fields(self, eod):
-        if 'customFieldList' in eod and eod['customFieldList']:
+    def prepare_custom_fields(self, eod, cache=None):
+        custom_field_values = eod.get('customFieldList')
+        if custom_field_values:
+            # lines of a journal often carry the same custom fields, build them once
+            key = tuple(
+                (field['type'], field.get('scriptId'), field.get('internalId'), field['value'])
+                for field in custom_field_values
+            )
+            if cache is not None and key in cache:
+                return cache[key]
             custom_fields = []
-            for field in eod['customFieldList']:
-                if field['type'] == 'String':
+            for field in custom_field_values:
+                field_type = field['type']
+                if field_type == 'String':
                     custom_fields.append(
                         self.ns_client.StringCustomFieldRef(
-                            scriptId=field['scriptId'] if 'scriptId' in field else None,
-                            internalId=field['internalId'] if 'internalId' in field else None,
+                            scriptId=field.get('scriptId'),
+                            internalId=field.get('internalId'),
                             value=field['value']
                         )
                     )
-                elif field['type'] == 'Select':
+                elif field_type == 'Select':
                     custom_fields.append(
                         self.ns_client.SelectCustomFieldRef(
-                            scriptId=field['scriptId'] if 'scriptId' in field else None,
-                            internalId=field['internalId'] if 'internalId' in field else None,
+                            scriptId=field.get('scriptId'),
+                            internalId=field.get('internalId'),
                             value=self.ns_client.ListOrRecordRef(
                                 internalId=field['value']
                             )
                         )
                     )
-            return self.ns_client.CustomFieldList(custom_fields)
+            custom_field_list = self.ns_client.CustomFieldList(custom_fields)
+            if cache is not None:
+                cache[key] = custom_field_list
+            return custom_field_list
         return None
 
-    def post(self, data) -> OrderedDict:
+    def build(self, data):
         assert data['externalId'], 'missing external id'
         je = self.ns_client.JournalEntry(externalId=data['externalId'])
         line_list = []
+        custom_fields_cache = {}
         for eod in data['lineList']:
-            eod['customFieldList'] = self.prepare_custom_fields(eod)
-            jee = self.ns_client.JournalEntryLine(**eod)
+            # the input is left as is, a retried post builds the record again from it
+            custom_field_list = self.prepare_custom_fields(eod, custom_fields_cache)
+            jee = self.ns_client.JournalEntryLine(**{**eod, 'customFieldList': custom_field_list})
             line_list.append(jee)
 
         je['lineList'] = self.ns_client.JournalEntryLineList(line=line_list)
         je['currency'] = self.ns_client.RecordRef(**(data['currency']))
 
-        if 'customFieldList' in data:
-            je['customFieldList'] = data['customFieldList']
-        
-        if 'memo' in data:
-            je['memo'] = data['memo']
-
-        if 'tranDate' in data:
-            je['tranDate'] = data['tranDate']
-
-        if 'tranId' in data:
-            je['tranId'] = data['tranId']
+        for field in self.passthrough_fields:
+            if field in data:
+                je[field] = data[field]
 
-        if 'subsidiary' in data:
-            je['subsidiary'] = data['subsidiary']
-
-        if 'class' in data:
-            je['class'] = data['class']
-
-        if 'location' in data:
-            je['location'] = data['location']
-
-        if 'department' in data:
-            je['department'] = data['department']
+        return je
 
+    def post(self, data) -> OrderedDict:
+        je = self.build(data)
         logger.info(
             f"Posting JournalEntries now with {len(je['lineList']['line'])} entries. ExternalId {je['externalId']} tranDate {je['tranDate']}")
         try:
@@ -185,3 +230,15 @@ class JournalEntries(ApiBase):
             logger.error(f"Error posting journal entry: {je}")
             raise e
         return self._serialize(res)
+
+    def post_many(self, data_list) -> list:
+        # One upsertList call for the whole batch instead of a request per journal entry
+        jes = [self.build(data) for data in data_list]
+        logger.info(
+            f"Posting {len(jes)} JournalEntries now. ExternalIds {[je['externalId'] for je in jes]}")
+        try:
+            res = self.ns_client.upsertList(jes)
+        except Exception as e:
+            logger.error(f"Error posting journal entries: {[je['externalId'] for je in jes]}")
+            raise e
+        return [self._serialize(r) for r in res]